@@ -28,138 +28,168 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+# Name lookup loader - held for the life of the process, keyed on the file's mtime
+# so edits to opsrev.csv still invalidate it; max_entries=1 drops the superseded table
+@st.cache_resource(max_entries=1)
+def load_name_table(mtime):
+    """Load the opsrev.csv user name lookup indexed by User_Id"""
+    opsrev_df = pd.read_csv(
+        'opsrev.csv',
+        dtype={'User_Id': 'int32', 'FULL_NAME': 'string', 'LOGIN_ID': 'string'}
+    )
+    return opsrev_df.set_index('User_Id')
+
+# Database engine - probed once per set of credentials and shared for the life of the process
+@st.cache_resource
+def make_engine(server, database, username, password):
+    """Find a working connection method and return its pooled engine"""
+    # Try different connection methods for cloud compatibility
+    connection_methods = [
+        # Method 1: pymssql (more cloud-friendly)
+        lambda: f"mssql+pymssql://{username}:{password}@{server}/{database}",
+        # Method 2: pyodbc with different drivers
+        lambda: f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver=ODBC+Driver+17+for+SQL+Server&Encrypt=yes&TrustServerCertificate=yes",
+        lambda: f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver=ODBC+Driver+18+for+SQL+Server&Encrypt=yes&TrustServerCertificate=yes",
+        lambda: f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver=FreeTDS&Encrypt=yes&TrustServerCertificate=yes"
+    ]
+    
+    engine = None
+    last_error = None
+    
+    for method in connection_methods:
+        try:
+            conn_str = method()
+            # pool_pre_ping/pool_recycle let stale pooled connections heal themselves
+            test_engine = create_engine(conn_str, pool_pre_ping=True, pool_recycle=1800)
+            # Test the connection
+            with test_engine.connect() as test_conn:
+                test_conn.execute(text("SELECT 1"))
+            engine = test_engine
+            break
+        except Exception as e:
+            last_error = str(e)
+            continue
+    
+    if not engine:
+        # Show debug info in development
+        debug_info = f"Could not establish database connection. Last error: {last_error}"
+        if not hasattr(st, 'secrets'):  # Only show in local development
+            debug_info += f"\nTried connecting to: {server}/{database} with user: {username}"
+        raise Exception(debug_info)
+    
+    return engine
+
 # Database connection function with automatic refresh
-@st.cache_data(ttl=300)  # Cache for 10 minutes (600 seconds) - fresh data every 10 minutes
+# Errors propagate to the caller so a failed fetch is not cached for the full TTL
+@st.cache_data(ttl=600)  # Cache for 10 minutes (600 seconds) - fresh data every 10 minutes
 def get_data_from_database():
     """Fetch data directly from database with caching"""
-    try:
-        # Get credentials from Streamlit secrets or environment variables
-        if hasattr(st, 'secrets') and 'database' in st.secrets:
-            # Streamlit Cloud secrets (TOML format)
-            server = st.secrets.database.SERVER
-            database = st.secrets.database.DATABASE
-            username = st.secrets.database.DB_USERNAME
-            password = st.secrets.database.DB_PASSWORD
-        else:
-            # Environment variables (for local development)
-            server = os.getenv('SERVER')
-            database = os.getenv('DATABASE')
-            username = os.getenv('DB_USERNAME')
-            password = os.getenv('DB_PASSWORD')
-        
-        if not all([server, database, username, password]):
-            raise Exception("Missing database credentials. Check .env file or Streamlit secrets.")
-        
-        # Try different connection methods for cloud compatibility
-        connection_methods = [
-            # Method 1: pymssql (more cloud-friendly)
-            lambda: f"mssql+pymssql://{username}:{password}@{server}/{database}",
-            # Method 2: pyodbc with different drivers
-            lambda: f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver=ODBC+Driver+17+for+SQL+Server&Encrypt=yes&TrustServerCertificate=yes",
-            lambda: f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver=ODBC+Driver+18+for+SQL+Server&Encrypt=yes&TrustServerCertificate=yes",
-            lambda: f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver=FreeTDS&Encrypt=yes&TrustServerCertificate=yes"
-        ]
-        
-        engine = None
-        last_error = None
-        
-        for method in connection_methods:
-            try:
-                conn_str = method()
-                test_engine = create_engine(conn_str)
-                # Test the connection
-                with test_engine.connect() as test_conn:
-                    test_conn.execute(text("SELECT 1"))
-                engine = test_engine
-                break
-            except Exception as e:
-                last_error = str(e)
-                continue
-        
-        if not engine:
-            # Show debug info in development
-            debug_info = f"Could not establish database connection. Last error: {last_error}"
-            if not hasattr(st, 'secrets'):  # Only show in local development
-                debug_info += f"\nTried connecting to: {server}/{database} with user: {username}"
-            raise Exception(debug_info)
-# Engine is already created above in the connection method testing
-        
-        # Query parameters
-        outcome_id = 1027
-        user_ids = [
-            1220, 12431, 3, 1336, 1137, 12432, 12271, 21, 12366, 32,
-            1662, 12436, 12437, 12433, 1222, 1404, 12321, 1770, 12476, 12167,
-            1992, 19, 12079, 12349, 12082, 12257, 6, 1956, 1785, 4,
-            1494, 12231, 1205, 1214, 12478, 12480, 12481, 1634, 12306, 12497
-        ]
-        
-        # September 1st, 2025 at 4 AM EST, converted to UTC for database query
-        eastern = pytz.timezone('US/Eastern')
-        start_time = eastern.localize(datetime(2025, 9, 1, 4, 0, 0)).astimezone(timezone.utc)
-        
-        # Build SQL query to get raw individual activity records (no grouping)
-        placeholders = ', '.join([f":id{i}" for i in range(len(user_ids))])
-        sql_query = f"""
+    # Get credentials from Streamlit secrets or environment variables
+    if hasattr(st, 'secrets') and 'database' in st.secrets:
+        # Streamlit Cloud secrets (TOML format)
+        server = st.secrets.database.SERVER
+        database = st.secrets.database.DATABASE
+        username = st.secrets.database.DB_USERNAME
+        password = st.secrets.database.DB_PASSWORD
+    else:
+        # Environment variables (for local development)
+        server = os.getenv('SERVER')
+        database = os.getenv('DATABASE')
+        username = os.getenv('DB_USERNAME')
+        password = os.getenv('DB_PASSWORD')
+    
+    if not all([server, database, username, password]):
+        raise Exception("Missing database credentials. Check .env file or Streamlit secrets.")
+    
+    engine = make_engine(server, database, username, password)
+    
+    # Query parameters - built here so they only run on a cache miss, not on every rerun
+    outcome_id = 1027
+    user_ids = [
+        1220, 12431, 3, 1336, 1137, 12432, 12271, 21, 12366, 32,
+        1662, 12436, 12437, 12433, 1222, 1404, 12321, 1770, 12476, 12167,
+        1992, 19, 12079, 12349, 12082, 12257, 6, 1956, 1785, 4,
+        1494, 12231, 1205, 1214, 12478, 12480, 12481, 1634, 12306, 12497
+    ]
+    # September 1st, 2025 at 4 AM EST, converted to UTC for database query
+    eastern = pytz.timezone('US/Eastern')
+    start_time = eastern.localize(datetime(2025, 9, 1, 4, 0, 0)).astimezone(timezone.utc)
+    
+    # Build SQL query that aggregates activity per user per Eastern day on the server
+    # User IDs go over as one comma-separated parameter and are expanded server-side
+    # (STRING_SPLIT needs the database at compatibility level 130 or higher)
+    # The 2025 max activity date rides along in the same round-trip; the LEFT JOIN
+    # keeps it even when no per-day rows match
+    sql_query = """
+    WITH daily AS (
         SELECT 
                 USER_ID,
-                ACTIVITY_DATE
+                CAST(ACTIVITY_DATE AT TIME ZONE 'UTC' AT TIME ZONE 'Eastern Standard Time' AS DATE) AS ACTIVITY_DAY_EST,
+                COUNT(*) AS CNT,
+                MAX(ACTIVITY_DATE) AS LAST_TS
         FROM FACT_ACTIVITY
         WHERE OUTCOME_ID = :outcome_id
-            AND USER_ID IN ({placeholders})
+            AND USER_ID IN (SELECT CAST(value AS INT) FROM STRING_SPLIT(:ids, ','))
             AND ACTIVITY_DATE >= :start_time
-        ORDER BY USER_ID, ACTIVITY_DATE DESC
-        """
-        
-        # Parameters
-        params = {"outcome_id": outcome_id, "start_time": start_time}
-        params.update({f"id{i}": uid for i, uid in enumerate(user_ids)})
-        
-        # Execute query
-        with engine.connect() as conn:
-            df = pd.read_sql(text(sql_query), conn, params=params)
-            
-            # Get max activity date from 2025 for "Data as of" metric
-            max_date_2025_query = "SELECT MAX(ACTIVITY_DATE) as max_activity_date FROM FACT_ACTIVITY WHERE YEAR(ACTIVITY_DATE) = 2025"
-            max_date_result = pd.read_sql(text(max_date_2025_query), conn)
-            max_activity_date_2025 = max_date_result['max_activity_date'].iloc[0]
-        
-        # Convert ACTIVITY_DATE to datetime and then to Eastern Time
-        try:
-            df['ACTIVITY_DATE'] = pd.to_datetime(df['ACTIVITY_DATE'])
-            eastern = pytz.timezone('US/Eastern')
-            df['ACTIVITY_DATE_EST'] = df['ACTIVITY_DATE'].dt.tz_localize('UTC').dt.tz_convert(eastern)
-            df['ACTIVITY_DATE_EST'] = df['ACTIVITY_DATE_EST'].dt.tz_localize(None)
-            df['ACTIVITY_DATE_ONLY'] = df['ACTIVITY_DATE_EST'].dt.date
-        except Exception as dt_error:
-            st.warning(f"Date conversion warning: {dt_error}")
-            # Fallback: use the original date column
-            df['ACTIVITY_DATE_EST'] = df['ACTIVITY_DATE']
-            df['ACTIVITY_DATE_ONLY'] = pd.to_datetime(df['ACTIVITY_DATE']).dt.date
-        
-        # Now group by USER_ID using pandas to get assessments completed and last activity
-        grouped_df = df.groupby('USER_ID').agg({
-            'ACTIVITY_DATE': 'count',  # Count of assessments
-            'ACTIVITY_DATE_EST': 'max'  # Latest activity datetime
-        }).reset_index()
-        
-        # Rename columns for clarity
-        grouped_df.columns = ['USER_ID', 'ASSESSMENTS_COMPLETED', 'LAST_ASSESSMENT_TIME']
-        
-        # Join with opsrev.csv for names
-        try:
-            opsrev_df = pd.read_csv('opsrev.csv')
-            merged_df = grouped_df.merge(opsrev_df, left_on='USER_ID', right_on='User_Id', how='left')
-            result = merged_df[['FULL_NAME', 'LOGIN_ID', 'ASSESSMENTS_COMPLETED', 'LAST_ASSESSMENT_TIME']].copy()
-            result.columns = [col.upper() for col in result.columns]
-            return result, datetime.now(), max_activity_date_2025, df  # Return raw data too
-        except FileNotFoundError:
-            # If opsrev.csv not found, return data without names
-            grouped_df.columns = [col.upper() for col in grouped_df.columns]
-            return grouped_df, datetime.now(), max_activity_date_2025, df  # Return raw data too
-            
-    except Exception as e:
-        st.error(f"Database connection failed: {e}")
-        return None, None, None, None
+        GROUP BY USER_ID, CAST(ACTIVITY_DATE AT TIME ZONE 'UTC' AT TIME ZONE 'Eastern Standard Time' AS DATE)
+    ),
+    max_2025 AS (
+        SELECT MAX(ACTIVITY_DATE) AS MAX_ACTIVITY_DATE_2025
+        FROM FACT_ACTIVITY
+        WHERE ACTIVITY_DATE >= CAST('2025-01-01' AS DATETIME2)
+            AND ACTIVITY_DATE < CAST('2026-01-01' AS DATETIME2)
+    )
+    SELECT 
+            daily.USER_ID,
+            daily.ACTIVITY_DAY_EST,
+            daily.CNT,
+            daily.LAST_TS,
+            max_2025.MAX_ACTIVITY_DATE_2025
+    FROM max_2025
+    LEFT JOIN daily ON 1 = 1
+    """
+    
+    # Parameters
+    params = {
+        "outcome_id": outcome_id,
+        "start_time": start_time,
+        "ids": ",".join(map(str, user_ids))
+    }
+    
+    # Execute query
+    with engine.connect() as conn:
+        df = pd.read_sql(text(sql_query), conn, params=params)
+    
+    # Split the "Data as of" value off the per-day rows and format it once here
+    max_activity_date_2025 = df['MAX_ACTIVITY_DATE_2025'].iloc[0]
+    if pd.isna(max_activity_date_2025):
+        data_as_of = "No 2025 data available"
+    else:
+        # Convert UTC to Eastern Time for display
+        eastern = pytz.timezone('US/Eastern')
+        max_date_utc = pd.to_datetime(max_activity_date_2025).tz_localize('UTC')
+        data_as_of = max_date_utc.tz_convert(eastern).strftime('%Y-%m-%d %H:%M')
+    df = df.dropna(subset=['USER_ID']).drop(columns='MAX_ACTIVITY_DATE_2025')
+    # Counts and IDs fit comfortably in 32 bits; avoid carrying int64 columns around
+    df = df.astype({'USER_ID': 'int32', 'CNT': 'int32'})
+    
+    # Convert LAST_TS to Eastern Time (day buckets are already Eastern from the query)
+    df['ACTIVITY_DAY_EST'] = pd.to_datetime(df['ACTIVITY_DAY_EST']).dt.date
+    try:
+        # One chained pass on the DatetimeIndex instead of re-wrapping a Series per step
+        eastern = pytz.timezone('US/Eastern')
+        df['LAST_TS'] = (
+            pd.DatetimeIndex(pd.to_datetime(df['LAST_TS']))
+            .tz_localize('UTC')
+            .tz_convert(eastern)
+            .tz_localize(None)
+        )
+    except Exception as dt_error:
+        st.warning(f"Date conversion warning: {dt_error}")
+    
+    # Per-user totals are rolled up from this per-day frame in the filter path,
+    # so only one groupby runs per rerun
+    return datetime.now(), data_as_of, df
 
 # Title
 st.title("Assessments Dashboard - Tiger Team 🐯")
@@ -242,66 +272,65 @@ with st.sidebar:
             st.rerun()
 
 # Get data
-df, last_fetched, max_activity_date_2025, raw_df = get_data_from_database()
+try:
+    last_fetched, data_as_of, raw_df = get_data_from_database()
+except Exception as e:
+    st.error(f"Database connection failed: {e}")
+    last_fetched, data_as_of, raw_df = None, None, None
 
-if df is not None and raw_df is not None:
+if raw_df is not None:
     
-    # Apply filters to raw data first, then re-group
-    filtered_raw = raw_df.copy()
+    # Reuse the last mask unless the date filter or the cached data (last_fetched) changed
+    filter_key = (last_fetched, tuple(date_range))
+    if st.session_state.get('filter_key') != filter_key:
+        # Build a single boolean mask over the per-day data, then index once
+        mask = pd.Series(True, index=raw_df.index)
+        
+        # Filter by date range
+        if len(date_range) == 2:
+            start_date, end_date = date_range
+            mask &= (raw_df['ACTIVITY_DAY_EST'] >= start_date) & (raw_df['ACTIVITY_DAY_EST'] <= end_date)
+        
+        st.session_state.filter_mask = mask
+        st.session_state.filter_key = filter_key
     
-    # Filter by date range
-    if len(date_range) == 2:
-        start_date, end_date = date_range
-        filtered_raw = filtered_raw[
-            (filtered_raw['ACTIVITY_DATE_ONLY'] >= start_date) & 
-            (filtered_raw['ACTIVITY_DATE_ONLY'] <= end_date)
-        ]
+    filtered_raw = raw_df[st.session_state.filter_mask]
     
-    # Re-group the filtered raw data
+    # Re-group the filtered per-day data
     if len(filtered_raw) > 0:
-        filtered_grouped = filtered_raw.groupby('USER_ID').agg({
-            'ACTIVITY_DATE': 'count',  # Count of assessments
-            'ACTIVITY_DATE_EST': 'max'  # Latest activity datetime
-        }).reset_index()
+        filtered_grouped = filtered_raw.groupby('USER_ID', as_index=False).agg(
+            ASSESSMENTS_COMPLETED=('CNT', 'sum'),  # Count of assessments
+            LAST_ASSESSMENT_TIME=('LAST_TS', 'max')  # Latest activity datetime
+        ).astype({'ASSESSMENTS_COMPLETED': 'int32'})
         
-        # Rename columns for clarity
-        filtered_grouped.columns = ['USER_ID', 'ASSESSMENTS_COMPLETED', 'LAST_ASSESSMENT_TIME']
-        
-        # Join with opsrev.csv for names (same as in main function)
+        # Join with opsrev.csv for names
         try:
-            opsrev_df = pd.read_csv('opsrev.csv')
-            merged_filtered = filtered_grouped.merge(opsrev_df, left_on='USER_ID', right_on='User_Id', how='left')
-            filtered_df = merged_filtered[['FULL_NAME', 'LOGIN_ID', 'ASSESSMENTS_COMPLETED', 'LAST_ASSESSMENT_TIME']].copy()
-            filtered_df.columns = [col.upper() for col in filtered_df.columns]
+            names_df = load_name_table(os.path.getmtime('opsrev.csv'))
+            merged_filtered = filtered_grouped.join(names_df, on='USER_ID')
+            filtered_df = merged_filtered[['FULL_NAME', 'LOGIN_ID', 'ASSESSMENTS_COMPLETED', 'LAST_ASSESSMENT_TIME']]
         except FileNotFoundError:
             # If opsrev.csv not found, return data without names
-            filtered_df = filtered_grouped[['ASSESSMENTS_COMPLETED', 'LAST_ASSESSMENT_TIME']].copy()
-            filtered_df.columns = [col.upper() for col in filtered_df.columns]
+            filtered_df = filtered_grouped[['ASSESSMENTS_COMPLETED', 'LAST_ASSESSMENT_TIME']]
     else:
         # No data after filtering
         filtered_df = pd.DataFrame(columns=['FULL_NAME', 'LOGIN_ID', 'ASSESSMENTS_COMPLETED', 'LAST_ASSESSMENT_TIME'])
 
+    # Compute metric values once
+    total_users = len(filtered_df)
+    total_assessments = int(filtered_df['ASSESSMENTS_COMPLETED'].sum()) if total_users > 0 else 0
+
     # Show metrics
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("Total Users", len(filtered_df))
+        st.metric("Total Users", total_users)
     with col2:
-        st.metric("Total Assessments", int(filtered_df['ASSESSMENTS_COMPLETED'].sum()) if len(filtered_df) > 0 else 0)
+        st.metric("Total Assessments", total_assessments)
     with col3:
-        # Get the maximum date from 2025 data
-        if pd.isna(max_activity_date_2025):
-            formatted_datetime = "No 2025 data available"
-        else:
-            # Convert UTC to Eastern Time for display
-            eastern = pytz.timezone('US/Eastern')
-            max_date_utc = pd.to_datetime(max_activity_date_2025).tz_localize('UTC')
-            max_date_est = max_date_utc.tz_convert(eastern)
-            formatted_datetime = max_date_est.strftime('%Y-%m-%d %H:%M')
-        st.metric("Data as of (EST)", formatted_datetime)
+        st.metric("Data as of (EST)", data_as_of)
     
     # Show table with index starting from 1, sorted by assessments completed (descending)
-    df_display = filtered_df.copy()
-    df_display = df_display.sort_values('ASSESSMENTS_COMPLETED', ascending=False)
+    # Rows come back unordered from SQL; this is the only sort
+    df_display = filtered_df.sort_values('ASSESSMENTS_COMPLETED', ascending=False, kind='stable')
     df_display.index = range(1, len(df_display) + 1)
     
     # Configure column widths